@@ -2,12 +2,90 @@
 
 import sys
 
+# FL register bit masks (FL bits: 00000LGE)
+FL_L = 0b100
+FL_G = 0b010
+FL_E = 0b001
+
+# Python source emitted for each opcode when a run of instructions is
+# translated into a block function (see CPU.translate_block). {a} and {b} are
+# the operand bytes masked to register numbers, {imm} is the raw second
+# operand byte and {next} is the address of the following instruction.
+# Opcodes that write to the stack check code_map afterwards: if the write
+# landed on translated code, the blocks covering it are dropped and this one
+# returns.
+BLOCK_OPS = {
+    0x00: "pass",                                                   # NOP
+    0x45: "v = R[{a}]; sp = R[7] = (R[7] - 1) & 255; RAM[sp] = v\n"  # PUSH
+          "if code_map[sp]: cpu.invalidate_code(sp); return {next}",
+    0x46: "sp = R[7]; R[7] = (sp + 1) & 255; R[{a}] = RAM[sp]",     # POP
+    0x47: "sys.stdout.write('%d\\n' % R[{a}])",                     # PRN
+    0x48: "sys.stdout.write(chr(R[{a}]))",                          # PRA
+    0x65: "R[{a}] = (R[{a}] + 1) & 255",                            # INC
+    0x66: "R[{a}] = (R[{a}] - 1) & 255",                            # DEC
+    0x69: "R[{a}] = ~R[{a}] & 255",                                 # NOT
+    0x82: "R[{a}] = {imm}",                                         # LDI
+    0x83: "R[{a}] = RAM[R[{b}]]",                                   # LD
+    0xA0: "R[{a}] = (R[{a}] + R[{b}]) & 255",                       # ADD
+    0xA1: "R[{a}] = (R[{a}] - R[{b}]) & 255",                       # SUB
+    0xA2: "R[{a}] = (R[{a}] * R[{b}]) & 255",                       # MUL
+    0xA7: "x = R[{a}]; y = R[{b}]; "                                # CMP
+          "cpu.FL = %d if x < y else %d if x > y else %d" % (FL_L, FL_G, FL_E),
+    0xA8: "R[{a}] &= R[{b}]",                                       # AND
+    0xAA: "R[{a}] |= R[{b}]",                                       # OR
+    0xAB: "R[{a}] ^= R[{b}]",                                       # XOR
+    0xAC: "R[{a}] = (R[{a}] << R[{b}]) & 255",                      # SHL
+    0xAD: "R[{a}] >>= R[{b}]",                                      # SHR
+}
+
+# Opcodes that end a block. Their source always returns the next PC.
+BLOCK_EXITS = {
+    0x11: "sp = R[7]; R[7] = (sp + 1) & 255; return RAM[sp]",       # RET
+    0x50: "sp = R[7] = (R[7] - 1) & 255; RAM[sp] = {next}\n"        # CALL
+          "if code_map[sp]: cpu.invalidate_code(sp)\n"
+          "return R[{a}]",
+    0x54: "return R[{a}]",                                          # JMP
+    0x55: "return R[{a}] if cpu.FL & %d else {next}" % FL_E,        # JEQ
+    0x56: "return {next} if cpu.FL & %d else R[{a}]" % FL_E,        # JNE
+    0x57: "return R[{a}] if cpu.FL & %d else {next}" % FL_G,        # JGT
+    0x58: "return R[{a}] if cpu.FL & %d else {next}" % FL_L,        # JLT
+    0x59: "return R[{a}] if cpu.FL & %d else {next}" % (FL_L | FL_E),  # JLE
+    0x5A: "return R[{a}] if cpu.FL & %d else {next}" % (FL_G | FL_E),  # JGE
+}
+# Anything else (HLT, ST, IRET, INT, DIV, MOD or an undefined opcode) is left
+# to step(). HLT runs once per program, and keeping it out of blocks means
+# run() only has to check HALT after step(). DIV and MOD can raise, and step()
+# leaves PC at the instruction that raised.
+
+# A conditional jump straight after CMP is translated as a direct comparison
+# of the two registers CMP just loaded into x and y, instead of re-reading
+# the flags it stored in FL
+CMP_JUMPS = {
+    0x55: "return R[{a}] if x == y else {next}",                    # JEQ
+    0x56: "return R[{a}] if x != y else {next}",                    # JNE
+    0x57: "return R[{a}] if x > y else {next}",                     # JGT
+    0x58: "return R[{a}] if x < y else {next}",                     # JLT
+    0x59: "return R[{a}] if x <= y else {next}",                    # JLE
+    0x5A: "return R[{a}] if x >= y else {next}",                    # JGE
+}
+
+# Longest run of instructions translated into a single block
+BLOCK_MAX = 64
+
+# Interrupt vectors I0-I7 live at RAM[0xF8]-RAM[0xFF]
+INTERRUPT_VECTORS = 0xF8
+# Number of instructions run() executes between checks for pending
+# interrupts. Blocks are never split, so a check can come up to BLOCK_MAX - 1
+# instructions late: run() polls every 64-127 instructions.
+INTERRUPT_POLL_INTERVAL = 64
+
 # Main CPU class
 class CPU:
     def __init__(self):
         # Construct a new CPU
         # Initialize 8 registers
-        self.R = [0] * 8
+        # bytearray keeps each register in a single byte instead of a boxed int
+        self.R = bytearray(8)
         # R7 is reserved as the stack pointer (SP)
         self.R[7] = 0xF4
         # Initizlize progrm counter
@@ -16,28 +94,29 @@ class CPU:
         # Initialize Instruction Register
         # IR: contains a copy of the currently executing instruction
         self.IR = 0
-        # Initialize Memory Address Register
-        # MAR: holds the memory address we're reading or writing 
-        self.MAR = 0
-        # Initialize Memory Data Register
-        # MDR: holds the value to write or just read
-        self.MDR = 0
         # Initizlize Flags 
         # FL: the flags (register FL) holds the current flags status. These flags can change based on the operands given to the CMP opcode
         self.FL = 0
         # Initialize memory
-        self.RAM = [0] * 256
+        # 256 bytes of RAM stored as raw bytes; stores outside 0-255 raise ValueError
+        self.RAM = bytearray(256)
         # Stretch 4: Add keyboard interrupts 
         # Allow interrupts
-        self.interrupts_enable = True
+        self.interrupts_enabled = True
         # The system is not halted at startup
         self.HALT = False
-        # The Program Counter is not set by an opcode by default
-        self.PC_SET = False
-        # Set registers for storing operands
-        self.opA = 0
-        self.opB = 0
-        
+        # Block cache: (block, instruction count) keyed by the address of the
+        # first instruction ((None, 1) if it has to go through step())
+        self.blocks = {}
+        # code_map[address] is 1 if that byte belongs to a translated block
+        self.code_map = bytearray(256)
+        # Addresses covered by each translated block, keyed like self.blocks
+        self.block_bytes = {}
+        # self_modified[address] is 1 if that byte was written after being
+        # translated. Instructions using it are left to step() from then on,
+        # so self-modifying code is not retranslated on every write.
+        self.self_modified = bytearray(256)
+
     """
     Registers
     8 general-purpose 8-bit numeric registers R0-R7:
@@ -46,29 +125,7 @@ class CPU:
         R7 is reserved as the stack pointer (SP)
     These registers only hold values between 0-255. After performing math on registers in the emulator, bitwise-AND the result with 0xFF (255) to keep the register values in that range.
     """
-    # Named register methods
-    def regOP(self, f, i):
-        # Perform operation on register
-        if 0 <= i and i < 8:
-            self.R[i] = f(self.R[i]) & 255
-            
-    def register(self, num):
-        # Get register associated with 8 bit input
-        return self.R[num & 7]
-    # Use @ property decorator: It's used to add functionality to the existing code. AKA metaprogramming, as a part of the program tries to modify another part of the program at compile time
-    @property
-    # R5 is reserved as the interrupt mask (IM)
-    def IM(self):
-        return self.R[5]
-    def set_IM(self, value):
-        self.R[5] = value
-    @property
-    # R6 is reserved as the interrupt status (IS)
-    def IS(self):
-        return self.R[6]
-    def set_IS(self, value):
-        self.R[6] = value
-        
+
     """
     The flags (register FL) holds the current flags status. These flags can change based on the operands given to the CMP Compare opcode. 
     The register is made up of 8 bits. if a particular bit is set, that flag is "true".
@@ -77,100 +134,15 @@ class CPU:
     G Greater-than: during a CMP, set to 1 if registerA > registerB, zero otherwise.
     E Equal: during a CMP, set to 1 if registerA == registerB, zero otherwise.
     """
-    # MVP 1. Add the euql flag to your LS-8
-    def flag(self, j):
-        # Get jth flag
-        i = j & 7
-        return (self.FL & 2 ** i) >> i
-    def set_flag(self, j, b):
-        # Set jth flag to b
-        i = j & 7
-        # zero ith bit
-        self.FL -= self.FL & 2 ** i
-        if b:
-            # set ith bit to 1
-            self.FL += 2 ** i
-    @property
-    def L(self):
-        # Less-than: during a CMP, set to 1 if registerA < registerB, zero otherwise
-        return self.flag(2)
-    def set_L(self, b):
-        self.set_flag(2, b)
-    @property
-    def G(self):
-        # Greater-than: during a CMP, set to 1 if registerA > registerB, zero otherwise
-        return self.flag(1)
-    def set_G(self, b):
-        self.set_flag(1, b)
-    @property
-    def E(self):
-        # Equal: during a CMP, set to 1 if registerA == registerB, zero otherwise
-        return self.flag(0)
-    def set_E(self, b):
-        self.set_flag(0, b)
-
-
-    # Named RAM methods
-    @property
-    def I7(self):
-        return self.RAM[255]
-    @property
-    def I6(self):
-        return self.RAM[254]
-    @property
-    def I5(self):
-        return self.RAM[253]
-    @property
-    def I4(self):
-        return self.RAM[252]
-    @property
-    def I3(self):
-        return self.RAM[251]
-    @property
-    def I2(self):
-        return self.RAM[250]
-    @property
-    def I1(self):
-        return self.RAM[249]
-    @property
-    def I0(self):
-        return self.RAM[248]
-    
-    @property
-    def Key(self):
-        return self.RAM[244]
-    
-    
-    # Read and Write methods
-    # MAR: Memory Address Register - holds the memory address we're readng or writing
-    # MDR: Memory Data Register - holds the value to write or just read
-    def ram_read(self):
-        self.MDR = self.RAM[self.MAR]
-        
-    def ram_write(self, value, address):
-        self.RAM[self.MAR] = self.MDR
-        
-    
-    # Stack related methods
-    def SP(self):
-        return self.R[7]
-    def set_SP(self, value):
-        self.R[7] = value
-        
-    def pop(self):
-        val = self.RAM[self.SP]
-        self.RAM[self.SP] = 0
-        self.set_SP((self.SP + 1) & 255)
-        return val
-    
-    def push(self, val):
-        self.set_SP((self.SP - 1) & 255)
-        self.RAM[self.SP] = val & 255
-        
-    
+
     # Opcode Functions:
+    # Every handler is called with the two bytes that follow the opcode in RAM
+    # as (a, b), whether or not the instruction uses them. The first operand
+    # is always a register, so step() masks it to a register number once;
+    # b is passed through as-is since it is an immediate for LDI.
     def create_opcode_table(self):
-        self.opcode_table = {}
+        # Indexed directly by the opcode byte; undefined opcodes map to bad_op
+        self.opcode_table = [self.bad_op] * 256
         # NOP: No Operation - Do nothing for this instruction
         self.opcode_table[0x00] = self.NOP
         self.opcode_table[0x01] = self.HLT
@@ -179,6 +151,7 @@ class CPU:
         self.opcode_table[0x45] = self.PUSH
         self.opcode_table[0x46] = self.POP
         self.opcode_table[0x47] = self.PRN
+        self.opcode_table[0x48] = self.PRA
         self.opcode_table[0x50] = self.CALL
         self.opcode_table[0x52] = self.INT
         self.opcode_table[0x54] = self.JMP
@@ -206,49 +179,58 @@ class CPU:
         self.opcode_table[0xAC] = self.SHL
         self.opcode_table[0xAD] = self.SHR
 
+        # Instruction length in bytes for every opcode. The two high bits
+        # (bits 6-7) of an opcode hold its number of operands, so the length
+        # is that count plus one for the opcode byte itself.
+        self.instr_len = bytes((i >> 6) + 1 for i in range(256))
 
     # MVP 1. Add the CMP instruction
-    def CMP(self):
+    def CMP(self, a, b):
         # Compare the values in 2 registers
         # If they are equal, set the Equal E flag to 1, otherwise set it to 0
         # If reigsterA is < registerB, set the Less-Than L flag to 1, otherwise set it to 0
         # If reigsterA is > registerB, set the Greater-Than G flag to 1, otherwise set it to 0
-        self.alu('CMP', self.opA, self.opB)
+        x = self.R[a]
+        y = self.R[b & 7]
+        # Exactly one of the three flags ends up set, so FL is written in one go
+        self.FL = FL_L if x < y else FL_G if x > y else FL_E
         
     # 2. Add the JMP instruction
-    def JMP(self):
+    def JMP(self, a, b):
         # Jump the address stored in the given register
-        self.PC_SET = True
-        self.PC = self.R[self.opA & 7]
+        return self.R[a]
         
     # 3. Add the JEQ & JNE instructions - MVP
-    def JEQ(self):
+    def JEQ(self, a, b):
         # If E (equal) flag is set (true), jump to the address stored in the given register
         # E == Equal: during a CMP, set to 1 if registerA is equal to registerB, zero otherwise
-        if self.E:
-            self.PC_SET = True
-            self.PC = self.R[self.opA & 7]
+        if self.FL & FL_E:
+            return self.R[a]
 
-    def JNE(self):
+    def JNE(self, a, b):
         # If E flag is clear (false, 0), jump to the address stored in the given register
-        if not self.E:
-            self.PC_SET = True
-            self.PC = self.R[self.opA & 7]
+        if not self.FL & FL_E:
+            return self.R[a]
         
-    def NOP(self):
+    def bad_op(self, a, b):
+        # Fills every opcode table slot without a handler
+        raise Exception(f'Undefined opcode {"0x{:02x}".format(self.IR)}.')
+
+    def NOP(self, a, b):
         """ No operation. Do nothing for this instruction. """
         pass
     
-    def HLT(self):
+    def HLT(self, a, b):
         # Halt the CPU (and exit the emulator)
         self.HALT = True
     
-    def RET(self):
+    def RET(self, a, b):
         # Return from subroutine. Pop the value from the top of the stack and store it in the PC
-        self.PC_SET = True
-        self.PC = self.pop()
+        sp = self.R[7]
+        self.R[7] = (sp + 1) & 255
+        return self.RAM[sp]
 
-    def IRET(self):
+    def IRET(self, a, b):
         """ 
         Return from an interrupt handler.
         The following steps are executed:
@@ -257,354 +239,356 @@ class CPU:
             The return address is popped off the stack and stored in PC
             Interrupts are re-enabled
         """
-        self.PC_SET = True
-        self.R[6] = self.pop()
-        self.R[5] = self.pop()
-        self.R[4] = self.pop()
-        self.R[3] = self.pop()
-        self.R[2] = self.pop()
-        self.R[1] = self.pop()
-        self.R[0] = self.pop()
-        self.FL = self.pop()
-        self.PC = self.pop()
+        RAM = self.RAM
+        sp = self.R[7]
+        for r in range(6, -1, -1):
+            self.R[r] = RAM[sp]
+            sp = (sp + 1) & 255
+        self.FL = RAM[sp]
+        pc = RAM[(sp + 1) & 255]
+        self.R[7] = (sp + 2) & 255
         self.interrupts_enabled = True  # Stretch 4: Add keyboard interrupts
-
-    def PUSH(self):
-        # Push the value in the given register on the stack
-        self.push(self.R[self.opA & 7])
-
-    def POP(self):
-        # Pop the value at the top of the stack into the given register
-        self.R[self.opA & 7] = self.pop()
-
-    def PRN(self):
+        return pc
+
+    def PUSH(self, a, b):
+        # Push the value in the given register on the stack. The stack
+        # pointer (R7) grows down from 0xF4: decrement SP, then write
+        value = self.R[a]
+        sp = self.R[7] = (self.R[7] - 1) & 255
+        self.RAM[sp] = value
+        # A push over translated code makes the translation stale
+        if self.code_map[sp]:
+            self.invalidate_code(sp)
+
+    def POP(self, a, b):
+        # Pop the value at the top of the stack into the given register:
+        # read at SP, then increment SP
+        sp = self.R[7]
+        self.R[7] = (sp + 1) & 255
+        self.R[a] = self.RAM[sp]
+
+    def PRN(self, a, b):
         # Print numeric value stored in the gien register
-        print(self.R[self.opA & 7])
+        sys.stdout.write('%d\n' % self.R[a])
 
-    def PRA(self):
+    def PRA(self, a, b):
         # Print alpha character value stored in the given register. 26 alphabetic characters, A to Z, and the 10 Arabic numerals, 0 to 9 for English
-        print(chr(self.R[self.opA & 7]), end='')
+        sys.stdout.write(chr(self.R[a]))
 
-    def CALL(self):
+    def CALL(self, a, b):
         # Calls a subroutine (function) at the address stored in the register.
-        self.PC_SET = True
         # The address of the instruction directly after CALL is pushed onto the stack. This allows us to return to where we left off when the subroutine finishes executing.
-        self.push((self.PC + 2) & 255)
+        sp = self.R[7] = (self.R[7] - 1) & 255
+        self.RAM[sp] = (self.PC + 2) & 255
+        if self.code_map[sp]:
+            self.invalidate_code(sp)
         # The PC is set to the address stored in the given register. We jump to that location in RAM and execute the first instruction in the subroutine. The PC can move forward or backwards from its current location.
-        self.PC = self.R[self.opA & 7]
+        return self.R[a]
 
-    def INT(self):
+    def INT(self, a, b):
         """
         Issue the interrupt number stored in the given register.
         This will set the _n_th bit in the IS register to the value in the given register.
         """
-        # TO DO
-        # PC_SET = True
-        pass
+        self.R[6] |= 1 << (self.R[a] & 7)
+        # A software interrupt is taken straight away instead of waiting for
+        # the next poll in run()
+        self.PC = (self.PC + 2) & 255
+        self.poll_interrupts()
+        return self.PC
 
-    def JGT(self):
+    def JGT(self, a, b):
         """
         If greater-than flag is set (true),
         jump to the address stored in the given register.
         """
-        if self.G:
-            self.PC_SET = True
-            self.PC = self.R[self.opA & 7]
+        if self.FL & FL_G:
+            return self.R[a]
 
-    def JLT(self):
+    def JLT(self, a, b):
         """
         If less-than is set (true),
         jump to the address stored in the given register.
         """
-        if self.L:
-            self.PC_SET = True
-            self.PC = self.R[self.opA & 7]
+        if self.FL & FL_L:
+            return self.R[a]
 
-    def JLE(self):
+    def JLE(self, a, b):
         """
         If less-than flag or equal flag is set (true),
         jump to the address stored in the given register.
         """
-        if self.L or self.E:
-            self.PC_SET = True
-            self.PC = self.R[self.opA & 7]
+        if self.FL & (FL_L | FL_E):
+            return self.R[a]
 
-    def JGE(self):
+    def JGE(self, a, b):
         """
         If greater-than flag or equal flag is set (true),
         jump to the address stored in the given register.
         """
-        if self.G or self.E:
-            self.PC_SET = True
-            self.PC = self.R[self.opA & 7]
+        if self.FL & (FL_G | FL_E):
+            return self.R[a]
 
-    def INC(self):
+    def INC(self, a, b):
         """
         Increment (add 1 to) the value in the given register.
         """
-        self.alu('INC', self.opA, self.opB)
+        self.R[a] = (self.R[a] + 1) & 255
 
-    def DEC(self):
+    def DEC(self, a, b):
         """
         Decrement (subtract 1 from) the value in the given register.
         """
-        self.alu('DEC', self.opA, self.opB)
+        self.R[a] = (self.R[a] - 1) & 255
 
-    def NOT(self):
+    def NOT(self, a, b):
         """
         Perform a bitwise-NOT on the value in a register,
         storing the result in the register.
         """
-        self.alu('NOT', self.opA, self.opB)
+        self.R[a] = (~self.R[a]) & 255
 
-    def LDI(self):
+    def LDI(self, a, b):
         """
         Set the value of a register to an integer.
         """
-        self.R[self.opA & 7] = self.opB
+        self.R[a] = b
 
-    def LD(self):
+    def LD(self, a, b):
         """
         Loads registerA with the value at the memory address stored in registerB.
         """
-        self.MAR = self.R[self.opB & 7]
-        self.ram_read()
-        self.R[self.opA & 7] = self.MDR
+        self.R[a] = self.RAM[self.R[b & 7]]
 
-    def ST(self):
+    def ST(self, a, b):
         """
         Store value in registerB in the address stored in registerA.
         This opcode writes to memory.
         """
-        self.MAR = self.R[self.opA & 7]
-        self.MDR = self.R[self.opB & 7]
-        self.ram_write()
+        address = self.R[a]
+        self.RAM[address] = self.R[b & 7]
+        # Writing over translated code makes the translation stale
+        if self.code_map[address]:
+            self.invalidate_code(address)
 
-    def ADD(self):
+    def ADD(self, a, b):
         """
         Add the value in two registers and store the result in registerA.
         """
-        self.alu('ADD', self.opA, self.opB)
+        self.R[a] = (self.R[a] + self.R[b & 7]) & 255
 
-    def SUB(self):
+    def SUB(self, a, b):
         """
         Subtract the value in the second register from the first,
         storing the result in registerA.
         """
-        self.alu('SUB', self.opA, self.opB)
+        self.R[a] = (self.R[a] - self.R[b & 7]) & 255
 
-    def MUL(self):
+    def MUL(self, a, b):
         """
         Multiply the values in two registers together and store the
         result in registerA.
         """
-        self.alu('MUL', self.opA, self.opB)
+        self.R[a] = (self.R[a] * self.R[b & 7]) & 255
 
-    def DIV(self):
+    def DIV(self, a, b):
         """
         Divide the value in the first register by the value in the second,
         storing the result in registerA.
         If the value in the second register is 0, the system should print
         an error message and halt.
         """
-        self.alu('DIV', self.opA, self.opB)
+        divisor = self.R[b & 7]
+        if divisor == 0:
+            raise Exception("Division by zero error")
+        self.R[a] = (self.R[a] // divisor) & 255
 
-    def MOD(self):
+    def MOD(self, a, b):
         """
         Divide the value in the first register by the value in the second,
         storing the remainder of the result in registerA.
         If the value in the second register is 0, the system should print
         an error message and halt.
         """
-        self.alu('MOD', self.opA, self.opB)
+        divisor = self.R[b & 7]
+        if divisor == 0:
+            raise Exception("Division by zero error")
+        self.R[a] = (self.R[a] % divisor) & 255
 
-    def AND(self):
+    def AND(self, a, b):
         """
         Perform a bitwise-AND between the values in registerA and
         registerB, storing the result in registerA.
         """
-        self.alu('AND', self.opA, self.opB)
+        self.R[a] = (self.R[a] & self.R[b & 7]) & 255
 
-    def OR(self):
+    def OR(self, a, b):
         """
         Perform a bitwise-OR between the values in registerA and
         registerB, storing the result in registerA.
         """
-        self.alu('OR', self.opA, self.opB)
+        self.R[a] = (self.R[a] | self.R[b & 7]) & 255
 
-    def XOR(self):
+    def XOR(self, a, b):
         """
         Perform a bitwise-XOR between the values in registerA and
         registerB, storing the result in registerA.
         """
-        self.alu('XOR', self.opA, self.opB)
+        self.R[a] = (self.R[a] ^ self.R[b & 7]) & 255
 
-    def SHL(self):
+    def SHL(self, a, b):
         """
         Shift the value in registerA left by the number of bits
         specified in registerB, filling the low bits with 0.
         """
-        self.alu('SHL', self.opA, self.opB)
+        self.R[a] = (self.R[a] << self.R[b & 7]) & 255
 
-    def SHR(self):
+    def SHR(self, a, b):
         """
         Shift the value in registerA right by the number of bits
         specified in registerB, filling the high bits with 0.
         """
-        self.alu('SHR', self.opA, self.opB)
+        self.R[a] = (self.R[a] >> self.R[b & 7]) & 255
     
         
-    # 4. Stretch: Add the ALU operations: `AND` `OR` `XOR` `NOT` `SHL` `SHR` `MOD`
-    # ALU Table
-    def create_ALU_table(self):
-        self.ALU_table = {}
-        # Increment (add 1 to) the value in the given register.
-        self.ALU_table["INC"] = self.ALU_INC
-        self.ALU_table["DEC"] = self.ALU_DEC
-        self.ALU_table["NOT"] = self.ALU_NOT  # Stretch
-        self.ALU_table["ADD"] = self.ALU_ADD  
-        self.ALU_table["SUB"] = self.ALU_SUB
-        self.ALU_table["MUL"] = self.ALU_MUL
-        self.ALU_table["DIV"] = self.ALU_DIV
-        self.ALU_table["MOD"] = self.ALU_MOD  # Stretch
-        self.ALU_table["CMP"] = self.ALU_CMP
-        self.ALU_table["AND"] = self.ALU_AND  # Stretch
-        self.ALU_table["OR"] = self.ALU_OR  # Stretch
-        self.ALU_table["XOR"] = self.ALU_XOR  # Stretch
-        self.ALU_table["SHL"] = self.ALU_SHL  # Stretch
-        self.ALU_table["SHR"] = self.ALU_SHR  # Stretch
-        
-    # 4. Stretch: Add the ALU operations: `AND` `OR` `XOR` `NOT` `SHL` `SHR` `MOD`
-    def ALU_AND(self, reg_a, reg_b):
-        self.R[reg_a] = self.R[reg_a] & self.R[reg_b]
-        
-    def ALU_OR(self, reg_a, reg_b):
-        self.R[reg_a] = self.R[reg_a] | self.R[reg_b]
-        
-    def ALU_XOR(self, reg_a, reg_b):
-        self.R[reg_a] = self.R[reg_a] ^ self.R[reg_b]
-        
-    # NOT register: Perform a bitwise-NOT on the value in a register, storing the result in the register
-    def ALU_NOT(self, reg_a, reg_b):
-        self.R[reg_a] = ~ self.R[reg_a]
-        
-    def ALU_SHL(self, reg_a, reg_b):
-        self.R[reg_a] = (self.R[reg_a] << self.R[reg_b]) & 255
-
-    def ALU_SHR(self, reg_a, reg_b):
-        self.R[reg_a] = self.R[reg_a] >> self.R[reg_b]
-    
-    # MOD registerA registerB: Divide the value in the first register by the value in the second, storing the remainder of the result in registerA. If the value in the secod register is 0, the system should print an error message and halt.
-    def ALU_MOD(self, reg_a, reg_b):
-        if self.R[reg_b] == 0:
-            raise Exception("Division by zero error")
-
-        self.R[reg_a] = (self.R[reg_a] % self.R[reg_b]) & 255
-        
-        
-    # INC register: Increment (add 1 to) the value in the given register
-    def ALU_INC(self, reg_a, reg_b):
-        self.R[reg_a] = (self.R[reg_a] + 1) & 255
-
-    # DEC register: Decrement (subtract 1 from) the value in the given register
-    def ALU_DEC(self, reg_a, reg_b):
-        self.R[reg_a] = (self.R[reg_a] - 1) & 255
-
-    # ADD registerA registerB: Add the values in two registers and store the result in registerA
-    def ALU_ADD(self, reg_a, reg_b):
-        self.R[reg_a] = (self.R[reg_a] + self.R[reg_b]) & 255
-
-    # SUB registerA registerB: Subtract the value in the second register from the first, storing the result in registerA
-    def ALU_SUB(self, reg_a, reg_b):
-        self.R[reg_a] = (self.R[reg_a] - self.R[reg_b]) & 255
-
-    # MUL registerA registerB: Multiply the values in two registers together and store the result in registerA
-    def ALU_MUL(self, reg_a, reg_b):
-        self.R[reg_a] = (self.R[reg_a] * self.R[reg_b]) & 255
-
-   # DIV registerA registerB: Divide the value in the first register by the value in the second, storing the result in registerA
-    def ALU_DIV(self, reg_a, reg_b):
-        if self.R[reg_b] == 0:
-            raise Exception("Division by zero error")
-
-        self.R[reg_a] = (self.R[reg_a] // self.R[reg_b]) & 255
-
-    def alu(self, op, reg_a, reg_b):
-        # Perform ALU operations
-        do = self.ALU_table.get(op, None)
-        if do is None:
-            raise Exception("Unsupported ALU operation")
-        do(reg_a, reg_b)
-
-    """
-    CMP registerA registerB
-    Compare the values in two registers:
-    If they are equal, set the Equal E flag to 1, otherwise set it to 0.
-    If registerA is less than registerB, set the Less-than flag to 1, otherwise set it to 0.
-    If registerA is greater than registerB, set the Greater-than G flag to 1, otherwise set it to 0.
-    """
-
-    def ALU_CMP(self, reg_a, reg_b):
-        self.set_L(False)
-        self.set_G(False)
-        self.set_E(False)
-
-        if self.R[reg_a] < self.R[reg_b]:
-            self.set_L(True)
-        elif self.R[reg_a] > self.R[reg_b]:
-            self.set_G(True)
-        else:
-            self.set_E(True)
-
-
     def load(self, program):
         # Load a program into Memory
         self.create_opcode_table()
-        self.create_ALU_table()
-
-        address = 0
 
-        for instruction in program:
-            self.RAM[address] = instruction
-            address += 1
+        if len(program) > len(self.RAM):
+            raise Exception("Program does not fit in RAM")
+        # Copy the whole program into RAM in one slice assignment
+        self.RAM[:len(program)] = bytes(program)
+
+        # Blocks are translated on first use by run(); drop any left over from
+        # a previous program
+        self.invalidate_blocks()
+
+
+    # Block translation
+    def translate_block(self, pc):
+        """
+        Translate the run of instructions starting at pc into a Python
+        function that executes all of them and returns the next PC.
+        Returns the function and the number of instructions it runs, or
+        (None, 1) if the instruction at pc must be run by step().
+        """
+        RAM = self.RAM
+        start = pc
+        lines = []
+        covered = set()
+        count = 0
+        ir = None
+
+        for _ in range(BLOCK_MAX):
+            prev_ir, ir = ir, RAM[pc]
+            length = self.instr_len[ir]
+            if prev_ir == 0xA7 and ir in CMP_JUMPS:
+                source = CMP_JUMPS[ir]
+            else:
+                source = BLOCK_OPS.get(ir) or BLOCK_EXITS.get(ir)
+            addresses = [(pc + i) & 255 for i in range(length)]
+            if source is None or any(self.self_modified[i] for i in addresses):
+                # Leave this instruction to step()
+                ir = None
+                break
+
+            imm = RAM[(pc + 2) & 255]
+            lines.extend(source.format(a=RAM[(pc + 1) & 255] & 7, b=imm & 7,
+                                       imm=imm, next=(pc + length) & 255)
+                         .split("\n"))
+            covered.update(addresses)
+            count += 1
+            pc = (pc + length) & 255
+            if ir in BLOCK_EXITS:
+                break
+
+        if not lines:
+            return None, 1
+        if ir not in BLOCK_EXITS:
+            lines.append(f"return {pc}")
+
+        source = ("def block(R=R, RAM=RAM, code_map=code_map, cpu=cpu):\n    "
+                  + "\n    ".join(lines))
+        code = compile(source, f"<ls8 block 0x{start:02x}>", "exec")
+        namespace = {"R": self.R, "RAM": self.RAM, "code_map": self.code_map,
+                     "cpu": self, "sys": sys}
+        exec(code, namespace)
+        for i in covered:
+            self.code_map[i] = 1
+        self.block_bytes[start] = covered
+        return namespace["block"], count
+
+    def poll_interrupts(self):
+        """
+        Dispatch the lowest-numbered pending interrupt, if there is one.
+        An interrupt is pending when its bit is set in both IM (R5) and IS (R6).
+        The following steps are executed:
+            The bit is cleared in IS and further interrupts are disabled
+            PC, FL and registers R0-R6 are pushed on the stack in that order
+            PC is set to the handler address from the interrupt vector table
+        """
+        if not self.interrupts_enabled:
+            return
+        pending = self.R[5] & self.R[6]
+        if not pending:
+            return
+
+        i = (pending & -pending).bit_length() - 1
+        self.R[6] &= ~(1 << i)
+        self.interrupts_enabled = False
+        RAM = self.RAM
+        sp = self.R[7]
+        for value in (self.PC, self.FL, *self.R[:7]):
+            sp = (sp - 1) & 255
+            RAM[sp] = value
+        self.R[7] = sp
+        for j in range(9):
+            if self.code_map[(sp + j) & 255]:
+                self.invalidate_code((sp + j) & 255)
+        self.PC = self.RAM[INTERRUPT_VECTORS + i]
+
+    def invalidate_blocks(self):
+        # Throw away every translated block (e.g. when a new program is
+        # loaded). code_map is cleared in place since blocks hold it
+        self.blocks.clear()
+        self.block_bytes.clear()
+        self.code_map[:] = bytes(256)
+        self.self_modified[:] = bytes(256)
+
+    def invalidate_code(self, address):
+        # Called after ST or a stack write changed a translated byte: drop
+        # only the blocks that cover it, and keep the byte out of later blocks
+        self.self_modified[address] = 1
+        for start, covered in list(self.block_bytes.items()):
+            if address in covered:
+                del self.blocks[start]
+                del self.block_bytes[start]
+        self.code_map[:] = bytes(256)
+        for covered in self.block_bytes.values():
+            for i in covered:
+                self.code_map[i] = 1
 
 
     def step(self):
         """Run a single program step"""
-        # Read byte at PC
-        self.MAR = self.PC
-        self.ram_read()
-        self.IR = self.MDR
-
-        # Read byte at PC+1
-        self.MAR = (self.MAR + 1) & 255
-        self.ram_read()
-        self.opA = self.MDR
-
-        # Read byte at PC+2
-        self.MAR = (self.MAR + 1) & 255
-        self.ram_read()
-        self.opB = self.MDR
-
-        # Set flag to see if the PC was set by an opcode
-        self.PC_SET = False
-
-        # Run opcode
-        op = self.opcode_table.get(self.IR, None)
-        if op is None:
-            raise Exception(f'Undefined opcode {"0x{:02x}".format(self.IR)}.')
-        op()
+        # Read the instruction byte at PC and the two operand bytes after it
+        RAM = self.RAM
+        pc = self.PC
+        self.IR = ir = RAM[pc]
+        opA = RAM[(pc + 1) & 255] & 7
+        opB = RAM[(pc + 2) & 255]
+
+        # Run opcode. Handlers return the new PC if the instruction jumped
+        # and None otherwise
+        new_pc = self.opcode_table[ir](opA, opB)
 
         # NOTE: The number of bytes an instruction uses can be determined from the
         # two high bits (bits 6-7) of the instruction opcode.
-        if not self.PC_SET:
-            high6 = (self.IR & 2 ** 6) >> 6
-            high7 = (self.IR & 2 ** 7) >> 7
-
-            if high6:
-                self.PC = (self.PC + 2) & 255
-            if high7:
-                self.PC = (self.PC + 3) & 255
+        if new_pc is None:
+            self.PC = (pc + self.instr_len[ir]) & 255
+        else:
+            self.PC = new_pc
 
 
     def run(self):
@@ -614,6 +598,50 @@ class CPU:
         """
         print("Running program...")
 
-        while not self.HALT:
-            self.step()
-            # print("PC:", self.PC)
+        # Run the translated block for the current PC, translating it the first
+        # time that address is reached, and fall back to interpreting a single
+        # instruction with step() where no block can be built. Pending
+        # interrupts are checked once INTERRUPT_POLL_INTERVAL instructions
+        # have run rather than before every instruction.
+        blocks = self.blocks
+        translate_block = self.translate_block
+        step = self.step
+        R = self.R
+
+        # PC is kept in a local while blocks run and only synced with self.PC
+        # around step() and poll_interrupts(), which work on self.PC, and when
+        # run() returns or raises
+        pc = self.PC
+        try:
+            while not self.HALT:
+                # Every dispatch runs at least one instruction, so the budget
+                # always runs out before the range does
+                budget = INTERRUPT_POLL_INTERVAL
+                for _ in range(INTERRUPT_POLL_INTERVAL):
+                    try:
+                        block, count = blocks[pc]
+                    except KeyError:
+                        block, count = blocks[pc] = translate_block(pc)
+                    if block is None:
+                        self.PC = pc
+                        step()
+                        pc = self.PC
+                        if self.HALT:
+                            break
+                    else:
+                        pc = block()
+                    # print("PC:", pc)
+                    budget -= count
+                    if budget <= 0:
+                        break
+                # A halted CPU takes no more interrupts
+                if self.HALT:
+                    break
+                # Only sync PC and call poll_interrupts() if an unmasked
+                # interrupt is pending
+                if self.interrupts_enabled and R[5] & R[6]:
+                    self.PC = pc
+                    self.poll_interrupts()
+                    pc = self.PC
+        finally:
+            self.PC = pc
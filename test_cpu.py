@@ -0,0 +1,205 @@
+"""Tests for the LS-8 CPU
+
+command line: python3 -m unittest test_cpu
+"""
+
+import contextlib
+import io
+import unittest
+
+from cpu import CPU
+
+
+def run_program(program, ram=None):
+    # Load and run a program, returning the CPU and everything it printed.
+    # ram maps extra addresses (e.g. interrupt vectors) to values.
+    cpu = CPU()
+    cpu.load(program)
+    for address, value in (ram or {}).items():
+        cpu.RAM[address] = value
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        cpu.run()
+    return cpu, out.getvalue().replace("Running program...\n", "")
+
+
+class CompareJumpTest(unittest.TestCase):
+    JLE, JGE = 0x59, 0x5A
+    # (jump opcode, R0, R1, taken)
+    CASES = [
+        (JLE, 3, 5, True), (JLE, 5, 5, True), (JLE, 7, 5, False),
+        (JGE, 7, 5, True), (JGE, 5, 5, True), (JGE, 3, 5, False),
+    ]
+
+    def test_jump_right_after_cmp(self):
+        # The block translator fuses CMP with the jump that follows it
+        for jump, x, y, taken in self.CASES:
+            with self.subTest(jump=hex(jump), x=x, y=y):
+                program = [
+                    0x82, 0x00, x,     # 0: LDI R0,x
+                    0x82, 0x01, y,     # 3: LDI R1,y
+                    0x82, 0x02, 0x0F,  # 6: LDI R2,15
+                    0xA7, 0x00, 0x01,  # 9: CMP R0,R1
+                    jump, 0x02,        # 12: Jcc R2
+                    0x01,              # 14: HLT
+                    0x82, 0x03, 0x01,  # 15: LDI R3,1
+                    0x01,              # 18: HLT
+                ]
+                cpu, _ = run_program(program)
+                self.assertEqual(cpu.R[3], int(taken))
+
+    def test_jump_reached_by_jmp(self):
+        # A block that starts at the jump has no CMP to fuse with, so the
+        # jump reads the flags the earlier CMP left in FL
+        for jump, x, y, taken in self.CASES:
+            with self.subTest(jump=hex(jump), x=x, y=y):
+                program = [
+                    0x82, 0x00, x,     # 0: LDI R0,x
+                    0x82, 0x01, y,     # 3: LDI R1,y
+                    0x82, 0x02, 0x14,  # 6: LDI R2,20
+                    0x82, 0x04, 0x11,  # 9: LDI R4,17
+                    0xA7, 0x00, 0x01,  # 12: CMP R0,R1
+                    0x54, 0x04,        # 15: JMP R4
+                    jump, 0x02,        # 17: Jcc R2
+                    0x01,              # 19: HLT
+                    0x82, 0x03, 0x01,  # 20: LDI R3,1
+                    0x01,              # 23: HLT
+                ]
+                cpu, _ = run_program(program)
+                self.assertEqual(cpu.R[3], int(taken))
+
+
+class FaultTest(unittest.TestCase):
+    def test_pc_left_at_faulting_instruction(self):
+        program = [
+            0x82, 0x00, 0x05,  # 0: LDI R0,5
+            0x82, 0x01, 0x00,  # 3: LDI R1,0
+            0x82, 0x02, 0x0B,  # 6: LDI R2,11
+            0x54, 0x02,        # 9: JMP R2
+            0x00,              # 11: NOP
+            0xA3, 0x00, 0x01,  # 12: DIV R0,R1
+        ]
+        cpu = CPU()
+        cpu.load(program)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaisesRegex(Exception, "Division by zero"):
+                cpu.run()
+        self.assertEqual(cpu.PC, 12)
+
+
+class StackTest(unittest.TestCase):
+    def test_call_into_translated_code(self):
+        # LDI R4,0; CALL R4 recurses until the stack grows down over the
+        # program itself, turning it into an undefined opcode
+        program = [0x82, 0x04, 0x00, 0x50, 0x04]
+        with self.assertRaisesRegex(Exception, "Undefined opcode"):
+            run_program(program)
+
+    def test_push_over_translated_code(self):
+        # Point SP into the program, then push 0x01 (HLT) over the LDI at
+        # address 9 that the running block has already translated
+        program = [
+            0x82, 0x07, 0x0A,  # 0: LDI R7,10
+            0x82, 0x01, 0x01,  # 3: LDI R1,1
+            0x45, 0x01,        # 6: PUSH R1
+            0x00,              # 8: NOP
+            0x82, 0x00, 0x2A,  # 9: LDI R0,42 (overwritten by the push)
+            0x47, 0x00,        # 12: PRN R0
+            0x01,              # 14: HLT
+        ]
+        cpu, out = run_program(program)
+        self.assertEqual(out, "")
+        self.assertEqual(cpu.PC, 10)
+
+
+class SelfModifyingCodeTest(unittest.TestCase):
+    def test_st_into_translated_code(self):
+        # Each pass of the loop stores the counter into the immediate of the
+        # LDI R3 at address 9, so PRN R3 sees the value from the last pass
+        program = [
+            0x82, 0x00, 0x00,  # 0: LDI R0,0
+            0x82, 0x01, 0xC8,  # 3: LDI R1,200
+            0x82, 0x02, 0x09,  # 6: LDI R2,9
+            0x82, 0x03, 0x00,  # 9: LDI R3,0 (immediate patched by ST)
+            0x65, 0x00,        # 12: INC R0
+            0x82, 0x04, 0x0B,  # 14: LDI R4,11
+            0x84, 0x04, 0x00,  # 17: ST R4,R0
+            0xA7, 0x00, 0x01,  # 20: CMP R0,R1
+            0x56, 0x02,        # 23: JNE R2
+            0x47, 0x03,        # 25: PRN R3
+            0x01,              # 27: HLT
+        ]
+        cpu, out = run_program(program)
+        self.assertEqual(out, "199\n")
+        self.assertEqual(cpu.RAM[11], 200)
+
+
+class InterruptTest(unittest.TestCase):
+    # Handler at address 14 for interrupt 0: LDI R1,99; PRN R1; IRET
+    HANDLER = [0x82, 0x01, 0x63, 0x47, 0x01, 0x13]
+
+    def test_int_and_iret(self):
+        program = [
+            0x82, 0x05, 0x01,  # 0: LDI R5,1 (unmask interrupt 0)
+            0x82, 0x00, 0x00,  # 3: LDI R0,0
+            0x82, 0x01, 0x07,  # 6: LDI R1,7
+            0x52, 0x00,        # 9: INT R0
+            0x47, 0x01,        # 11: PRN R1
+            0x01,              # 13: HLT
+        ] + self.HANDLER
+        cpu, out = run_program(program, {0xF8: 14})
+        # IRET restores R1 and returns to the instruction after INT
+        self.assertEqual(out, "99\n7\n")
+        self.assertEqual(cpu.R[7], 0xF4)
+        self.assertEqual(cpu.R[6], 0)
+        self.assertTrue(cpu.interrupts_enabled)
+
+    def test_polled_interrupt(self):
+        # Setting IS directly leaves the interrupt for run() to pick up
+        program = [
+            0x82, 0x05, 0x01,  # 0: LDI R5,1
+            0x82, 0x06, 0x01,  # 3: LDI R6,1
+            0x82, 0x02, 0x09,  # 6: LDI R2,9
+            0x54, 0x02,        # 9: JMP R2
+            0x82, 0x01, 0x2A,  # 11: LDI R1,42 (handler)
+            0x47, 0x01,        # 14: PRN R1
+            0x01,              # 16: HLT
+        ]
+        cpu, out = run_program(program, {0xF8: 11})
+        self.assertEqual(out, "42\n")
+        # PC, FL and R0-R6 are still on the stack
+        self.assertEqual(cpu.R[7], 0xF4 - 9)
+        self.assertFalse(cpu.interrupts_enabled)
+
+    def test_poll_counts_instructions(self):
+        # Each pass of the loop is one long block. The pending interrupt must
+        # be taken after INTERRUPT_POLL_INTERVAL instructions, not after that
+        # many blocks
+        program = [
+            0x82, 0x05, 0x01,  # 0: LDI R5,1
+            0x82, 0x06, 0x01,  # 3: LDI R6,1
+            0x82, 0x02, 0x09,  # 6: LDI R2,9
+        ] + [0x00] * 50 + [    # 9: NOP x 50
+            0x65, 0x00,        # 59: INC R0
+            0x54, 0x02,        # 61: JMP R2
+            0x47, 0x00,        # 63: PRN R0 (handler)
+            0x01,              # 65: HLT
+        ]
+        cpu, out = run_program(program, {0xF8: 63})
+        self.assertEqual(out, "2\n")
+
+    def test_no_interrupt_after_halt(self):
+        program = [
+            0x82, 0x05, 0x01,  # 0: LDI R5,1
+            0x82, 0x06, 0x01,  # 3: LDI R6,1
+            0x01,              # 6: HLT
+        ]
+        cpu, out = run_program(program, {0xF8: 0x20})
+        self.assertEqual(cpu.PC, 7)
+        self.assertEqual(cpu.R[7], 0xF4)
+        self.assertEqual(cpu.R[6], 1)
+        self.assertTrue(cpu.interrupts_enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()